@@ -10,15 +10,66 @@ This script gathers training data from:
 """
 
 import sys
-import json
-import psycopg2
+import statistics
+import orjson
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import ConnectionPool
+from collections import Counter
 from pathlib import Path
 from typing import List, Dict, Any
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass
 import argparse
 
 
-@dataclass
+# Blog posts and training_pairs normalized to one row shape
+# (input_text, output_text, source_type, quality_score, metadata);
+# takes min_quality as its only parameter. source_id is the row's primary
+# key, used only to break dedup ties deterministically. metadata is JSON-encoded text:
+# training_pairs.metadata is free-form TEXT, so it is wrapped as a JSON
+# string with to_json rather than parsed, and a malformed blob can never
+# fail the query
+EXAMPLES_QUERY = """
+    SELECT raw_transcription AS input_text,
+           final_content AS output_text,
+           'blog' AS source_type,
+           1.0::real AS quality_score,
+           json_build_object('post_id', id, 'title', title)::text AS metadata,
+           id AS source_id
+    FROM blog_posts
+    WHERE raw_transcription IS NOT NULL
+      AND raw_transcription != ''
+      AND final_content IS NOT NULL
+      AND final_content != ''
+      AND status IN ('published', 'public')
+    UNION ALL
+    SELECT input_text,
+           output_text,
+           source_type,
+           COALESCE(quality_score, 1.0)::real,
+           COALESCE(to_json(NULLIF(metadata, ''))::text, '{}'),
+           id
+    FROM training_pairs
+    WHERE output_text IS NOT NULL
+      AND output_text != ''
+      AND COALESCE(quality_score, 1.0) >= %s
+"""
+
+# Deduplicate in the database so a pair present in both tables is only
+# trained on once, keeping its highest-quality copy. Score ties prefer the
+# blog copy, then the lowest source_id, so the surviving row (and the
+# tokenized cache keyed on the output file) is reproducible. The ::json
+# cast is safe because EXAMPLES_QUERY only produces valid JSON metadata
+DEDUP_EXAMPLES_QUERY = f"""
+    SELECT DISTINCT ON (md5(input_text), md5(output_text))
+           input_text, output_text, source_type, quality_score,
+           metadata::json AS metadata
+    FROM ({EXAMPLES_QUERY}) examples
+    ORDER BY md5(input_text), md5(output_text), quality_score DESC,
+             (source_type = 'blog') DESC, source_id
+"""
+
+
+@dataclass(slots=True)
 class TrainingExample:
     """Represents a single training example"""
     input_text: str
@@ -27,97 +78,65 @@ class TrainingExample:
     quality_score: float = 1.0
     metadata: Dict[str, Any] = None
 
-    def to_dict(self):
-        return asdict(self)
-
 
 class DataCollector:
     """Collects training data from various sources"""
 
     def __init__(self, db_config: Dict[str, str]):
         self.db_config = db_config
-        self.conn = None
+        self.pool = None
         self.examples: List[TrainingExample] = []
 
     def connect(self):
-        """Connect to PostgreSQL database"""
+        """Create a PostgreSQL connection pool"""
         try:
-            self.conn = psycopg2.connect(
+            conninfo = make_conninfo(
                 host=self.db_config.get('host', 'localhost'),
                 port=self.db_config.get('port', 5432),
                 user=self.db_config.get('user', 'pedrocli'),
                 password=self.db_config.get('password', 'pedrocli'),
-                database=self.db_config.get('database', 'pedrocli_blog')
+                dbname=self.db_config.get('database', 'pedrocli_blog')
             )
+            self.pool = ConnectionPool(conninfo, min_size=1, max_size=4, open=True)
+            # Fail fast instead of on first checkout if the database is unreachable
+            self.pool.wait(timeout=10)
             print(f"✓ Connected to database: {self.db_config['database']}")
         except Exception as e:
             print(f"✗ Failed to connect to database: {e}", file=sys.stderr)
             sys.exit(1)
 
     def close(self):
-        """Close database connection"""
-        if self.conn:
-            self.conn.close()
-
-    def collect_from_blog_posts(self):
-        """Collect training pairs from published blog posts"""
-        print("\nCollecting data from blog posts...")
-
-        cursor = self.conn.cursor()
-        query = """
-            SELECT raw_transcription, final_content, title, id
-            FROM blog_posts
-            WHERE raw_transcription IS NOT NULL
-              AND final_content IS NOT NULL
-              AND status IN ('published', 'public')
-        """
-
-        cursor.execute(query)
-        rows = cursor.fetchall()
-
-        for raw, final, title, post_id in rows:
-            if raw and final:
-                example = TrainingExample(
-                    input_text=raw,
-                    output_text=final,
-                    source_type='blog',
-                    metadata={
-                        'post_id': str(post_id),
-                        'title': title
-                    }
-                )
-                self.examples.append(example)
-
-        cursor.close()
-        print(f"  → Collected {len(rows)} examples from blog posts")
-
-    def collect_from_training_pairs(self):
-        """Collect existing training pairs from database"""
-        print("\nCollecting data from training_pairs table...")
-
-        cursor = self.conn.cursor()
-        query = """
-            SELECT input_text, output_text, source_type, quality_score, metadata
-            FROM training_pairs
-            WHERE output_text IS NOT NULL
-              AND output_text != ''
-        """
-
-        cursor.execute(query)
-        rows = cursor.fetchall()
-
-        for input_text, output_text, source_type, quality_score, metadata in rows:
-            example = TrainingExample(
-                input_text=input_text,
-                output_text=output_text,
-                source_type=source_type,
-                quality_score=quality_score or 1.0,
-                metadata=metadata or {}
-            )
-            self.examples.append(example)
-
-        cursor.close()
-        print(f"  → Collected {len(rows)} examples from training_pairs")
+        """Close all pooled database connections"""
+        if self.pool:
+            self.pool.close()
+
+    def collect_from_database(self, min_quality: float = 0.5):
+        """Collect deduplicated examples from blog_posts and training_pairs"""
+        print("\nCollecting data from blog posts and training_pairs...")
+
+        # The pool ends the read transaction when the connection is returned
+        with self.pool.connection() as conn:
+            # Named (server-side) cursor so rows stream in itersize batches
+            # instead of materializing every post in memory at once. Text
+            # result format: binary would decode REAL scores at float32
+            # precision (0.8 -> 0.800000011920929), unlike the COPY path
+            with conn.cursor(name='collect_examples') as cursor:
+                cursor.itersize = 2000
+                cursor.execute(DEDUP_EXAMPLES_QUERY, (min_quality,))
+
+                count = 0
+                for input_text, output_text, source_type, quality_score, metadata in cursor:
+                    example = TrainingExample(
+                        input_text=input_text,
+                        output_text=output_text,
+                        source_type=source_type,
+                        quality_score=quality_score,
+                        metadata=metadata
+                    )
+                    self.examples.append(example)
+                    count += 1
+
+        print(f"  → Collected {count} unique examples (min_quality={min_quality})")
 
     def collect_from_twitch(self, twitch_dir: Path):
         """Collect data from Twitch VOD transcripts
@@ -128,21 +147,53 @@ class DataCollector:
         print("  → TODO: Implement Twitch VOD transcript collection")
         # Placeholder for Twitch integration
 
-    def filter_by_quality(self, min_score: float = 0.5):
-        """Filter examples by quality score"""
-        before = len(self.examples)
-        self.examples = [ex for ex in self.examples if ex.quality_score >= min_score]
-        after = len(self.examples)
-        print(f"\nFiltered {before - after} low-quality examples (min_score={min_score})")
-
     def save_to_jsonl(self, output_path: Path):
         """Save collected examples to JSONL file"""
-        with open(output_path, 'w') as f:
+        # orjson serializes dataclasses natively, skipping the asdict() deep copy
+        with open(output_path, 'wb', buffering=1 << 20) as f:
             for example in self.examples:
-                f.write(json.dumps(example.to_dict()) + '\n')
+                f.write(orjson.dumps(example, option=orjson.OPT_APPEND_NEWLINE))
 
         print(f"\n✓ Saved {len(self.examples)} examples to {output_path}")
 
+    def export_with_copy(self, output_path: Path, min_quality: float = 0.5):
+        """Stream database examples straight to JSONL with COPY ... TO STDOUT
+
+        PostgreSQL renders each row as JSON with the same fields as
+        save_to_jsonl, so no per-row Python objects or encoding are needed.
+        """
+        print("\nExporting blog posts and training_pairs with COPY...")
+
+        # CSV with quote/delimiter bytes that never appear in JSON output
+        # (control chars are \u-escaped) writes each JSON value verbatim;
+        # text format would double every backslash escape
+        query = f"""
+            COPY (
+                SELECT json_build_object(
+                    'input_text', input_text,
+                    'output_text', output_text,
+                    'source_type', source_type,
+                    'quality_score', quality_score,
+                    'metadata', metadata
+                )::text
+                FROM ({DEDUP_EXAMPLES_QUERY}) examples
+            ) TO STDOUT WITH (FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')
+        """
+
+        count = 0
+        with self.pool.connection() as conn, conn.cursor() as cursor, \
+                open(output_path, 'wb', buffering=1 << 20) as f:
+            # Let the dedup hash/sort use parallel workers; SET LOCAL keeps it
+            # to this transaction. (Named cursors never get parallel plans.)
+            cursor.execute("SET LOCAL max_parallel_workers_per_gather = 4")
+            with cursor.copy(query, (min_quality,)) as copy:
+                # Chunks arrive as memoryview, which has no .count()
+                for data in copy:
+                    f.write(data)
+                    count += bytes(data).count(b'\n')
+
+        print(f"\n✓ Saved {count} examples to {output_path} (min_quality={min_quality})")
+
     def print_stats(self):
         """Print collection statistics"""
         print("\n" + "="*60)
@@ -151,9 +202,7 @@ class DataCollector:
         print(f"Total examples: {len(self.examples)}")
 
         # Count by source type
-        source_counts = {}
-        for ex in self.examples:
-            source_counts[ex.source_type] = source_counts.get(ex.source_type, 0) + 1
+        source_counts = Counter(ex.source_type for ex in self.examples)
 
         print("\nBy source type:")
         for source, count in sorted(source_counts.items()):
@@ -161,8 +210,7 @@ class DataCollector:
 
         # Quality distribution
         if self.examples:
-            scores = [ex.quality_score for ex in self.examples]
-            avg_score = sum(scores) / len(scores)
+            avg_score = statistics.fmean(ex.quality_score for ex in self.examples)
             print(f"\nAverage quality score: {avg_score:.2f}")
 
 
@@ -184,6 +232,8 @@ def main():
                         help='Database name')
     parser.add_argument('--twitch-dir', type=str, default=None,
                         help='Directory containing Twitch VOD transcripts')
+    parser.add_argument('--copy-fast', action='store_true',
+                        help='Export database sources directly with COPY (skips Twitch and statistics)')
 
     args = parser.parse_args()
 
@@ -200,15 +250,16 @@ def main():
     try:
         collector.connect()
 
-        # Collect from all sources
-        collector.collect_from_blog_posts()
-        collector.collect_from_training_pairs()
+        if args.copy_fast:
+            collector.export_with_copy(Path(args.output), args.min_quality)
+            return
+
+        # Collect from all sources (quality filtering happens in SQL)
+        collector.collect_from_database(args.min_quality)
 
         if args.twitch_dir:
             collector.collect_from_twitch(Path(args.twitch_dir))
 
-        # Filter and save
-        collector.filter_by_quality(args.min_quality)
         collector.print_stats()
         collector.save_to_jsonl(Path(args.output))
 
@@ -0,0 +1,23 @@
+"""
+instructions.py - Instruction prompts shared by prepare_dataset.py and train_lora.py
+
+Kept free of third-party imports so train_lora.py can load it before its
+optional training dependencies are checked.
+"""
+
+_INSTRUCTION = """Transform the following raw dictation into a polished, narrative-driven blog post.
+
+Guidelines:
+- Identify and clearly state the central thesis
+- Organize content with strong narrative flow
+- Maintain authentic voice and tone
+- Include engaging opening and strong conclusion
+- End with clear call to action
+"""
+
+# Instruction texts by reference, used by --compact-instruction datasets
+# (train_lora.format_prompt resolves "instruction_ref" through this table)
+DEFAULT_INSTRUCTION_REF = "blog_v1"
+INSTRUCTIONS = {
+    DEFAULT_INSTRUCTION_REF: _INSTRUCTION,
+}
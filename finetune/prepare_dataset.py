@@ -8,14 +8,20 @@ Converts collected training data into format suitable for fine-tuning:
 - Tokenizes and prepares for training
 """
 
-import json
+import sys
+import orjson
 import argparse
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import Iterable, Iterator, Optional, Tuple, Dict, Any
 import random
 
+from instructions import DEFAULT_INSTRUCTION_REF, INSTRUCTIONS
 
-def format_as_instruction(example: Dict[str, Any]) -> Dict[str, str]:
+
+_INSTRUCTION = INSTRUCTIONS[DEFAULT_INSTRUCTION_REF]
+
+
+def format_as_instruction(example: Dict[str, Any], compact: bool = False) -> Dict[str, str]:
     """
     Format training example as instruction-following format
 
@@ -25,44 +31,88 @@ def format_as_instruction(example: Dict[str, Any]) -> Dict[str, str]:
         "input": "<raw dictation>",
         "output": "<polished blog post>"
     }
+
+    With compact=True, "instruction" is replaced by an "instruction_ref"
+    key into INSTRUCTIONS instead of repeating the full text on every line.
     """
-    instruction = """Transform the following raw dictation into a polished, narrative-driven blog post.
-
-Guidelines:
-- Identify and clearly state the central thesis
-- Organize content with strong narrative flow
-- Maintain authentic voice and tone
-- Include engaging opening and strong conclusion
-- End with clear call to action
-"""
+    if compact:
+        instruction = {"instruction_ref": DEFAULT_INSTRUCTION_REF}
+    else:
+        instruction = {"instruction": _INSTRUCTION}
 
     return {
-        "instruction": instruction,
+        **instruction,
         "input": example['input_text'],
         "output": example['output_text'],
         "source": example.get('source_type', 'unknown')
     }
 
 
-def split_dataset(examples: List[Dict], train_ratio: float = 0.9) -> tuple:
-    """Split dataset into train and validation sets"""
-    random.shuffle(examples)
-    split_idx = int(len(examples) * train_ratio)
-    return examples[:split_idx], examples[split_idx:]
+def iter_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield examples from a JSONL file one line at a time"""
+    # Binary mode skips the text-decode pass; orjson parses UTF-8 bytes directly
+    with open(path, 'rb', buffering=1 << 20) as f:
+        for line in f:
+            yield orjson.loads(line)
+
 
+def split_dataset(examples: Iterable[Dict], train_ratio: float = 0.9,
+                  rng: Optional[random.Random] = None) -> Iterator[Tuple[str, Dict]]:
+    """Assign each example to 'train' or 'val' in one streaming pass
 
-def save_jsonl(examples: List[Dict], path: Path):
-    """Save examples to JSONL file"""
-    with open(path, 'w') as f:
-        for example in examples:
-            f.write(json.dumps(example) + '\n')
+    Uses an independent Bernoulli draw per example instead of shuffling,
+    so the split size is train_ratio in expectation rather than exactly.
+    The first example always goes to 'val' (when train_ratio < 1) so small
+    corpora never end up with an empty validation set. Draws from the
+    global random module when no rng is given.
+    """
+    draw = (rng or random).random
+    for i, example in enumerate(examples):
+        if i == 0 and train_ratio < 1:
+            yield 'val', example
+            continue
+        yield ('train' if draw() < train_ratio else 'val'), example
+
+
+class LengthStats:
+    """Running input/output length statistics, updated one example at a time"""
+
+    def __init__(self):
+        self.count = 0
+        self.total_input = 0
+        self.total_output = 0
+        self.max_input = 0
+        self.max_output = 0
+
+    def update(self, example: Dict[str, str]):
+        input_len = len(example['input'])
+        output_len = len(example['output'])
+
+        # Integer running sums are exact and cheaper than a per-step mean
+        # update; averages are derived once in print_stats
+        self.count += 1
+        self.total_input += input_len
+        self.total_output += output_len
+        self.max_input = max(self.max_input, input_len)
+        self.max_output = max(self.max_output, output_len)
+
+    def print_stats(self, name: str):
+        print(f"\n{name} set:")
+        print(f"  Examples: {self.count}")
+        if not self.count:
+            return
+        print(f"  Avg input length:  {self.total_input / self.count:.0f} chars")
+        print(f"  Avg output length: {self.total_output / self.count:.0f} chars")
+        print(f"  Max input length:  {self.max_input} chars")
+        print(f"  Max output length: {self.max_output} chars")
 
 
 def print_example(example: Dict):
     """Pretty print an example for review"""
     print("\n" + "="*80)
     print("INSTRUCTION:")
-    print(example['instruction'][:200] + "...")
+    instruction = example.get('instruction') or INSTRUCTIONS[example['instruction_ref']]
+    print(instruction[:200] + "...")
     print("\nINPUT:")
     print(example['input'][:300] + "..." if len(example['input']) > 300 else example['input'])
     print("\nOUTPUT:")
@@ -82,43 +132,53 @@ def main():
                         help='Random seed for reproducibility')
     parser.add_argument('--show-example', action='store_true',
                         help='Show a sample example')
+    parser.add_argument('--compact-instruction', action='store_true',
+                        help='Write an instruction_ref instead of the full instruction text per example')
 
     args = parser.parse_args()
 
-    random.seed(args.seed)
+    rng = random.Random(args.seed)
     output_dir = Path(args.output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    print(f"Loading examples from {args.input}...")
-    examples = []
-    with open(args.input, 'r') as f:
-        for line in f:
-            examples.append(json.loads(line))
-
-    print(f"Loaded {len(examples)} examples")
-
-    # Format as instruction-following
-    print("\nFormatting as instruction-following examples...")
-    formatted = [format_as_instruction(ex) for ex in examples]
-
-    # Show example if requested
-    if args.show_example and formatted:
-        print("\nSample formatted example:")
-        print_example(formatted[0])
-
-    # Split dataset
-    print(f"\nSplitting dataset (train_ratio={args.train_ratio})...")
-    train, val = split_dataset(formatted, args.train_ratio)
-
-    print(f"  Train: {len(train)} examples")
-    print(f"  Val:   {len(val)} examples")
-
-    # Save datasets
     train_path = output_dir / 'train.jsonl'
     val_path = output_dir / 'val.jsonl'
-
-    save_jsonl(train, train_path)
-    save_jsonl(val, val_path)
+    train_stats = LengthStats()
+    val_stats = LengthStats()
+
+    # Single streaming pass: read -> format -> split -> write, so the
+    # dataset is never held in memory
+    print(f"Streaming examples from {args.input}...")
+    print("  Formatting as instruction-following examples")
+    print(f"  Splitting dataset (train_ratio={args.train_ratio})")
+
+    with open(train_path, 'wb', buffering=1 << 20) as train_f, \
+            open(val_path, 'wb', buffering=1 << 20) as val_f:
+        buckets = {'train': (train_f, train_stats), 'val': (val_f, val_stats)}
+        formatted = (
+            format_as_instruction(ex, compact=args.compact_instruction)
+            for ex in iter_jsonl(args.input)
+        )
+
+        for i, (bucket, example) in enumerate(split_dataset(formatted, args.train_ratio, rng)):
+            # Show example if requested
+            if i == 0 and args.show_example:
+                print("\nSample formatted example:")
+                print_example(example)
+
+            f, stats = buckets[bucket]
+            f.write(orjson.dumps(example, option=orjson.OPT_APPEND_NEWLINE))
+            stats.update(example)
+
+    print(f"\nProcessed {train_stats.count + val_stats.count} examples")
+    print(f"  Train: {train_stats.count} examples")
+    print(f"  Val:   {val_stats.count} examples")
+
+    # train_lora.py evaluates and picks the best checkpoint on the val set
+    if not train_stats.count or not val_stats.count:
+        print("\n✗ Train and validation sets must both be non-empty "
+              "(need at least 2 input examples and 0 < train_ratio < 1)", file=sys.stderr)
+        sys.exit(1)
 
     print(f"\n✓ Saved training dataset to {train_path}")
     print(f"✓ Saved validation dataset to {val_path}")
@@ -128,18 +188,8 @@ def main():
     print("DATASET STATISTICS")
     print("="*80)
 
-    def calc_stats(examples, name):
-        input_lengths = [len(ex['input']) for ex in examples]
-        output_lengths = [len(ex['output']) for ex in examples]
-        print(f"\n{name} set:")
-        print(f"  Examples: {len(examples)}")
-        print(f"  Avg input length:  {sum(input_lengths) / len(input_lengths):.0f} chars")
-        print(f"  Avg output length: {sum(output_lengths) / len(output_lengths):.0f} chars")
-        print(f"  Max input length:  {max(input_lengths)} chars")
-        print(f"  Max output length: {max(output_lengths)} chars")
-
-    calc_stats(train, "Training")
-    calc_stats(val, "Validation")
+    train_stats.print_stats("Training")
+    val_stats.print_stats("Validation")
 
     print("\n" + "="*80)
     print("\nNext steps:")
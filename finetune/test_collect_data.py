@@ -0,0 +1,74 @@
+"""Tests for collect_data.py (run with: python -m pytest finetune)"""
+
+from contextlib import contextmanager
+from unittest import mock
+
+import orjson
+from psycopg.adapt import Transformer
+from psycopg.pq import Format
+
+from collect_data import DataCollector
+
+
+def _pool_yielding(chunks=(), rows=()):
+    """Mock connection pool whose COPY yields chunks and whose cursor yields rows"""
+    copy = mock.MagicMock()
+    copy.__iter__.return_value = iter(chunks)
+
+    cursor = mock.MagicMock()
+    cursor.__enter__.return_value = cursor
+    cursor.__iter__.return_value = iter(rows)
+    cursor.copy.return_value.__enter__.return_value = copy
+
+    conn = mock.MagicMock()
+    conn.cursor.return_value = cursor
+
+    pool = mock.MagicMock()
+
+    @contextmanager
+    def connection():
+        yield conn
+
+    pool.connection = connection
+    pool.conn = conn
+    return pool
+
+
+def test_export_with_copy_handles_memoryview_chunks(tmp_path, capsys):
+    # psycopg 3 yields COPY data as memoryview, not bytes
+    lines = [b'{"input_text":"a"}\n', b'{"input_text":"b"}\n']
+    collector = DataCollector({})
+    collector.pool = _pool_yielding([memoryview(line) for line in lines])
+
+    output = tmp_path / 'out.jsonl'
+    collector.export_with_copy(output)
+
+    assert output.read_bytes() == b''.join(lines)
+    assert "Saved 2 examples" in capsys.readouterr().out
+
+
+def test_cursor_and_copy_paths_write_the_same_quality_score(tmp_path):
+    # training_pairs.quality_score is REAL; decode it the way psycopg does
+    # for the cursor's result format
+    score = Transformer().get_loader(700, Format.TEXT).load(b'0.8')
+    row = ('in', 'out', 'dictation', score, {})
+
+    collector = DataCollector({})
+    collector.pool = _pool_yielding(rows=[row])
+    collector.collect_from_database()
+    # Binary results decode float4 at float32 precision
+    assert not collector.pool.conn.cursor.call_args.kwargs.get('binary')
+
+    cursor_output = tmp_path / 'cursor.jsonl'
+    collector.save_to_jsonl(cursor_output)
+
+    # What PostgreSQL's json_build_object emits for the same REAL value
+    copy_line = b'{"input_text" : "in", "output_text" : "out", "source_type" : "dictation", ' \
+                b'"quality_score" : 0.8, "metadata" : {}}\n'
+    copy_output = tmp_path / 'copy.jsonl'
+    collector.pool = _pool_yielding(chunks=[memoryview(copy_line)])
+    collector.export_with_copy(copy_output)
+
+    cursor_score = orjson.loads(cursor_output.read_bytes())['quality_score']
+    copy_score = orjson.loads(copy_output.read_bytes())['quality_score']
+    assert cursor_score == copy_score == 0.8
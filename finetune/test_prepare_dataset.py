@@ -0,0 +1,43 @@
+"""Tests for prepare_dataset.py (run with: python -m pytest finetune)"""
+
+import random
+
+from prepare_dataset import LengthStats, split_dataset
+
+
+def test_split_dataset_keeps_order_and_every_example():
+    examples = list(range(50))
+    split = list(split_dataset(examples, 0.9, random.Random(0)))
+    assert [ex for _, ex in split] == examples
+    assert {bucket for bucket, _ in split} == {'train', 'val'}
+
+
+def test_split_dataset_never_leaves_val_empty():
+    for seed in range(200):
+        buckets = [b for b, _ in split_dataset(range(20), 0.9, random.Random(seed))]
+        assert 'val' in buckets
+
+
+def test_split_dataset_is_reproducible_for_a_seed():
+    first = list(split_dataset(range(100), 0.8, random.Random(42)))
+    second = list(split_dataset(range(100), 0.8, random.Random(42)))
+    assert first == second
+
+
+def test_length_stats():
+    stats = LengthStats()
+    stats.update({'input': 'abc', 'output': 'de'})
+    stats.update({'input': 'a', 'output': 'defgh'})
+
+    assert stats.count == 2
+    assert stats.total_input / stats.count == 2
+    assert stats.total_output / stats.count == 3.5
+    assert stats.max_input == 3
+    assert stats.max_output == 5
+
+
+def test_length_stats_empty_prints_count_only(capsys):
+    LengthStats().print_stats("Validation")
+    out = capsys.readouterr().out
+    assert "Examples: 0" in out
+    assert "Avg" not in out
@@ -7,12 +7,19 @@ Compatible with RTX 5090 or DGX Spark.
 """
 
 import argparse
+import hashlib
 import json
+import os
 import torch
 from pathlib import Path
 from dataclasses import dataclass, field
 from typing import Optional
 
+from instructions import INSTRUCTIONS
+
+# Bump whenever format_prompt or tokenize_dataset changes what gets cached
+TOKENIZE_RECIPE_VERSION = 1
+
 try:
     from transformers import (
         AutoModelForCausalLM,
@@ -22,7 +29,7 @@ try:
         DataCollatorForLanguageModeling,
     )
     from peft import LoraConfig, get_peft_model, TaskType, prepare_model_for_kbit_training
-    from datasets import load_dataset
+    from datasets import load_dataset, load_from_disk
     HAS_DEPS = True
 except ImportError:
     HAS_DEPS = False
@@ -35,12 +42,18 @@ class FineTuneConfig:
     # Model
     base_model: str = "Qwen/Qwen-3-7B"  # TODO: Update to actual Qwen 3 model name
     model_max_length: int = 4096
+    tokenize_num_proc: int = min(8, os.cpu_count() or 1)
+    use_flash_attention: bool = True
+    gradient_checkpointing: bool = True
 
     # LoRA
     lora_r: int = 16
-    lora_alpha: int = 32
+    lora_alpha: int = 8  # rsLoRA scale is alpha/sqrt(r): 8/sqrt(16) = 2
     lora_dropout: float = 0.05
-    lora_target_modules: list = field(default_factory=lambda: ["q_proj", "v_proj"])
+    lora_target_modules: list = field(default_factory=lambda: [
+        "q_proj", "k_proj", "v_proj", "o_proj", "gate_proj", "up_proj", "down_proj",
+    ])
+    use_rslora: bool = True
 
     # Training
     num_train_epochs: int = 3
@@ -53,6 +66,15 @@ class FineTuneConfig:
     eval_steps: int = 100
     save_steps: int = 100
     save_total_limit: int = 3
+    group_by_length: bool = True
+    optim: str = "paged_adamw_8bit"  # bitsandbytes>=0.41; pages state to CPU under pressure
+    tf32: bool = True  # Ampere or newer
+    dataloader_num_workers: int = 4
+    torch_compile: bool = False
+    torch_compile_mode: str = "reduce-overhead"
+    # reduce-overhead records a CUDA graph per input shape, so compiled runs
+    # pad to coarse buckets (8 lengths at 4096) instead of multiples of 8
+    compile_pad_to_multiple_of: int = 512
 
     # QLoRA (4-bit quantization)
     use_qlora: bool = True
@@ -64,11 +86,13 @@ class FineTuneConfig:
     # Paths
     output_dir: str = "./checkpoints"
     logging_dir: str = "./logs"
+    tokenized_cache_dir: str = "./.tok_cache"
 
 
 def format_prompt(example):
     """Format example into prompt for training"""
-    instruction = example['instruction']
+    # Compact datasets store a reference instead of the full instruction
+    instruction = example.get('instruction') or INSTRUCTIONS[example['instruction_ref']]
     input_text = example['input']
     output_text = example['output']
 
@@ -118,6 +142,10 @@ def setup_model_and_tokenizer(config: FineTuneConfig):
         "torch_dtype": torch.bfloat16,
     }
 
+    if config.use_flash_attention:
+        # Requires: pip install flash-attn --no-build-isolation
+        model_kwargs["attn_implementation"] = "flash_attention_2"
+
     if config.use_qlora:
         print("Using QLoRA (4-bit quantization)")
         from transformers import BitsAndBytesConfig
@@ -137,6 +165,10 @@ def setup_model_and_tokenizer(config: FineTuneConfig):
     if config.use_qlora:
         model = prepare_model_for_kbit_training(model)
 
+    if config.gradient_checkpointing:
+        model.gradient_checkpointing_enable(gradient_checkpointing_kwargs={"use_reentrant": False})
+        model.config.use_cache = False  # KV cache is incompatible with checkpointing
+
     # Setup LoRA
     print(f"\nSetting up LoRA (r={config.lora_r}, alpha={config.lora_alpha})")
     peft_config = LoraConfig(
@@ -146,6 +178,8 @@ def setup_model_and_tokenizer(config: FineTuneConfig):
         lora_alpha=config.lora_alpha,
         lora_dropout=config.lora_dropout,
         target_modules=config.lora_target_modules,
+        use_rslora=config.use_rslora,
+        init_lora_weights="gaussian",
     )
 
     model = get_peft_model(model, peft_config)
@@ -154,35 +188,91 @@ def setup_model_and_tokenizer(config: FineTuneConfig):
     return model, tokenizer
 
 
-def train(config: FineTuneConfig, train_path: str, val_path: str):
-    """Run fine-tuning"""
-
-    # Load data
-    dataset = load_and_prepare_data(train_path, val_path)
+def tokenize_dataset(dataset, tokenizer, config: FineTuneConfig):
+    """Tokenize formatted prompts for causal LM training"""
 
-    # Setup model
-    model, tokenizer = setup_model_and_tokenizer(config)
-
-    # Tokenize
+    # Tokenize without padding; the collator pads each batch to its own
+    # longest sequence instead of every example to model_max_length
     def tokenize_function(examples):
-        return tokenizer(
+        tokenized = tokenizer(
             examples["text"],
             truncation=True,
             max_length=config.model_max_length,
-            padding="max_length",
+            padding=False,
         )
+        # Token counts for the length-grouped sampler (group_by_length)
+        tokenized["length"] = [len(ids) for ids in tokenized["input_ids"]]
+        return tokenized
 
     print("\nTokenizing datasets...")
-    tokenized_dataset = dataset.map(
+    return dataset.map(
         tokenize_function,
         batched=True,
+        batch_size=1000,
+        num_proc=config.tokenize_num_proc,
         remove_columns=dataset["train"].column_names,
     )
 
-    # Data collator
+
+def tokenized_cache_path(config: FineTuneConfig, train_path: str, val_path: str) -> Path:
+    """Cache location keyed on the input files and tokenizer settings"""
+    # Include size/mtime so re-running prepare_dataset.py invalidates the cache
+    stamps = "|".join(
+        f"{os.path.getsize(p)}:{os.stat(p).st_mtime_ns}" for p in (train_path, val_path)
+    )
+    # Compact datasets expand instruction_ref at format time, so the
+    # instruction texts are part of the tokenized output too
+    instructions_hash = hashlib.sha1(json.dumps(INSTRUCTIONS, sort_keys=True).encode()).hexdigest()
+    key_src = (
+        f"{TOKENIZE_RECIPE_VERSION}|{instructions_hash}|{train_path}|{val_path}|{stamps}|"
+        f"{config.base_model}|{config.model_max_length}"
+    )
+    key = hashlib.sha1(key_src.encode()).hexdigest()[:12]
+    return Path(config.tokenized_cache_dir) / key
+
+
+def load_tokenized_dataset(config: FineTuneConfig, tokenizer, train_path: str, val_path: str):
+    """Load tokenized datasets from the Arrow cache, tokenizing on a miss"""
+    cache_path = tokenized_cache_path(config, train_path, val_path)
+
+    if cache_path.exists():
+        print(f"\nLoading tokenized datasets from cache: {cache_path}")
+        # keep_in_memory=False memory-maps the Arrow files instead of reading them
+        return load_from_disk(str(cache_path), keep_in_memory=False)
+
+    dataset = load_and_prepare_data(train_path, val_path)
+    tokenized_dataset = tokenize_dataset(dataset, tokenizer, config)
+
+    # Write to a temp dir first so an interrupted save never looks like a hit
+    tmp_path = cache_path.with_name(cache_path.name + ".tmp")
+    tokenized_dataset.save_to_disk(str(tmp_path))
+    tmp_path.rename(cache_path)
+    print(f"  Cached tokenized datasets to {cache_path}")
+
+    return tokenized_dataset
+
+
+def train(config: FineTuneConfig, train_path: str, val_path: str):
+    """Run fine-tuning"""
+
+    # Setup model
+    model, tokenizer = setup_model_and_tokenizer(config)
+
+    # Load data
+    tokenized_dataset = load_tokenized_dataset(config, tokenizer, train_path, val_path)
+
+    # torch.compile fuses the small dequant/matmul/LoRA-delta kernels, but
+    # bitsandbytes 4-bit layers are not reliably traceable, so QLoRA runs eager
+    torch_compile = config.torch_compile and not config.use_qlora
+    if config.torch_compile and config.use_qlora:
+        print("\nSkipping torch.compile: not supported with QLoRA (use --use-lora)")
+
+    # Data collator (dynamic per-batch padding, rounded up for tensor cores,
+    # or to coarse buckets under torch.compile to bound recompiles)
     data_collator = DataCollatorForLanguageModeling(
         tokenizer=tokenizer,
         mlm=False,
+        pad_to_multiple_of=config.compile_pad_to_multiple_of if torch_compile else 8,
     )
 
     # Training arguments
@@ -199,10 +289,18 @@ def train(config: FineTuneConfig, train_path: str, val_path: str):
         eval_steps=config.eval_steps,
         save_steps=config.save_steps,
         save_total_limit=config.save_total_limit,
+        group_by_length=config.group_by_length,
+        length_column_name="length",
         evaluation_strategy="steps",
         save_strategy="steps",
         load_best_model_at_end=True,
         bf16=True,
+        tf32=config.tf32,
+        optim=config.optim,
+        dataloader_num_workers=config.dataloader_num_workers,
+        dataloader_pin_memory=True,
+        torch_compile=torch_compile,
+        torch_compile_mode=config.torch_compile_mode if torch_compile else None,
         report_to="none",  # Change to "wandb" if using Weights & Biases
     )
 
@@ -247,10 +345,16 @@ def main():
                         help='Output directory for checkpoints')
     parser.add_argument('--use-lora', action='store_true',
                         help='Use LoRA instead of QLoRA (full precision)')
+    parser.add_argument('--no-flash-attn', action='store_true',
+                        help='Disable Flash-Attention 2 (for GPUs that do not support it)')
+    parser.add_argument('--compile', action='store_true',
+                        help='Compile the model with torch.compile (LoRA only; adds cold-start time)')
     parser.add_argument('--lora-r', type=int, default=16,
                         help='LoRA rank')
-    parser.add_argument('--lora-alpha', type=int, default=32,
-                        help='LoRA alpha')
+    parser.add_argument('--lora-alpha', type=int, default=8,
+                        help='LoRA alpha (adapter scale is alpha/sqrt(r) with rsLoRA)')
+    parser.add_argument('--lora-targets', type=str, default=None,
+                        help='Comma-separated LoRA target modules, or "all-linear" for every linear layer')
     parser.add_argument('--epochs', type=int, default=3,
                         help='Number of training epochs')
     parser.add_argument('--batch-size', type=int, default=4,
@@ -261,6 +365,12 @@ def main():
     args = parser.parse_args()
 
     # Create config
+    extra = {}
+    if args.lora_targets == 'all-linear':
+        extra["lora_target_modules"] = "all-linear"  # expanded by PEFT per architecture
+    elif args.lora_targets:
+        extra["lora_target_modules"] = [m.strip() for m in args.lora_targets.split(',')]
+
     config = FineTuneConfig(
         base_model=args.base_model,
         lora_r=args.lora_r,
@@ -271,6 +381,9 @@ def main():
         learning_rate=args.learning_rate,
         output_dir=args.output_dir,
         use_qlora=not args.use_lora,
+        use_flash_attention=not args.no_flash_attn,
+        torch_compile=args.compile,
+        **extra,
     )
 
     # Run training